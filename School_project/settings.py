@@ -77,6 +77,10 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Keep connections open between requests instead of reconnecting each time
+        'CONN_MAX_AGE': 600,
+        # Verify a reused connection is still alive before handing it to a request
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
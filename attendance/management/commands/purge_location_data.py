@@ -0,0 +1,47 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from attendance.models import UserProfile, AttendanceRecord
+
+
+class Command(BaseCommand):
+    help = "Clear check-in location data older than each student's location retention period"
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        default_days = settings.GEOLOCATION_SETTINGS['LOCATION_DATA_RETENTION_DAYS']
+        located = AttendanceRecord.objects.filter(check_in_lat__isnull=False)
+
+        # One bulk UPDATE per distinct retention period rather than one per record
+        retention_periods = UserProfile.objects.values_list(
+            'location_data_retention_days', flat=True
+        ).distinct()
+
+        cleared = 0
+        for days in retention_periods:
+            cleared += self.clear(located.filter(
+                student__profile__location_data_retention_days=days,
+                date__lt=today - timedelta(days=days)
+            ))
+
+        # Students without a profile fall back to the site-wide default
+        cleared += self.clear(located.filter(
+            student__profile__isnull=True,
+            date__lt=today - timedelta(days=default_days)
+        ))
+
+        self.stdout.write(self.style.SUCCESS(f"Cleared location data from {cleared} attendance records"))
+
+    def clear(self, records):
+        # The distance and notes are derived from the position, so they go too;
+        # is_valid_location is kept as the check-in outcome
+        return records.update(
+            check_in_lat=None,
+            check_in_lng=None,
+            check_in_accuracy=None,
+            verified_distance=None,
+            verification_notes='',
+        )
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-16 16:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0002_attendance_record_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='enrollment',
+            index=models.Index(fields=['class_enrolled', 'is_active', 'student'], name='enrollment_roster_idx'),
+        ),
+    ]
@@ -2,6 +2,40 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 import math
+import secrets
+
+# Number of random join PINs checked against existing classes per query
+JOIN_PIN_CANDIDATES = 10
+
+# Earth's radius in meters
+EARTH_RADIUS_M = 6371000
+
+def haversine_distance(lat1, lon1, lat2, lon2):
+    """Calculate Haversine distance in meters between two points"""
+    lat1_rad = math.radians(lat1)
+    lat2_rad = math.radians(lat2)
+    dlat = lat2_rad - lat1_rad
+    dlon = math.radians(lon2 - lon1)
+
+    a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon/2)**2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+
+    return EARTH_RADIUS_M * c
+
+# Coordinate delta (degrees, ~11 km) below which the flat-earth approximation is used
+SHORT_RANGE_DEGREES = 0.1
+
+def geo_distance(lat1, lon1, lat2, lon2):
+    """Calculate distance in meters, skipping the full haversine for nearby points"""
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    if abs(dlat) > SHORT_RANGE_DEGREES or abs(dlon) > SHORT_RANGE_DEGREES:
+        return haversine_distance(lat1, lon1, lat2, lon2)
+
+    # Equirectangular approximation: well under 0.1% error at geo-fence scales
+    x = math.radians(dlon) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(dlat)
+    return EARTH_RADIUS_M * math.hypot(x, y)
 
 class UserProfile(models.Model):
     ROLE_CHOICES = [
@@ -75,9 +109,15 @@ class Class(models.Model):
         return f"{self.course_code} - {self.course_name}"
 
     def generate_join_pin(self):
-        """Generate a random 6-digit PIN for class joining"""
-        import random
-        self.join_pin = str(random.randint(100000, 999999))
+        """Generate an unused random 6-digit PIN for class joining"""
+        while True:
+            # Check a batch of candidates in one query rather than one per attempt
+            candidates = {str(100000 + secrets.randbelow(900000)) for _ in range(JOIN_PIN_CANDIDATES)}
+            taken = set(Class.objects.filter(join_pin__in=candidates).values_list('join_pin', flat=True))
+            free = candidates - taken
+            if free:
+                self.join_pin = free.pop()
+                break
         self.save()
 
 class Enrollment(models.Model):
@@ -88,6 +128,10 @@ class Enrollment(models.Model):
 
     class Meta:
         unique_together = ['student', 'class_enrolled']
+        indexes = [
+            # Class rosters: finds the active students of a class without scanning other classes
+            models.Index(fields=['class_enrolled', 'is_active', 'student'], name='enrollment_roster_idx'),
+        ]
 
     def __str__(self):
         return f"{self.student.username} in {self.class_enrolled.course_code}"
@@ -155,6 +199,12 @@ class AttendanceRecord(models.Model):
     class Meta:
         unique_together = ['student', 'class_session', 'date']
         ordering = ['-date', '-check_in_time']
+        indexes = [
+            # Teacher views: a class's records for a given day
+            models.Index(fields=['class_session', 'date'], name='attendance_class_date_idx'),
+            # Student views: a student's records newest first
+            models.Index(fields=['student', '-date'], name='attendance_student_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.student.username} - {self.class_session.course_code} - {self.date}"
@@ -165,28 +215,10 @@ class AttendanceRecord(models.Model):
             self.class_session.geo_fence_lat is None or self.class_session.geo_fence_lng is None):
             return None
 
-        # Haversine formula implementation
-        lat1 = float(self.check_in_lat)
-        lon1 = float(self.check_in_lng)
-        lat2 = float(self.class_session.geo_fence_lat)
-        lon2 = float(self.class_session.geo_fence_lng)
-
-        # Convert to radians
-        lat1_rad = math.radians(lat1)
-        lon1_rad = math.radians(lon1)
-        lat2_rad = math.radians(lat2)
-        lon2_rad = math.radians(lon2)
-
-        # Haversine formula
-        dlat = lat2_rad - lat1_rad
-        dlon = lon2_rad - lon1_rad
-
-        a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon/2)**2
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-
-        # Earth's radius in meters
-        R = 6371000
-        distance = R * c
+        distance = geo_distance(
+            float(self.check_in_lat), float(self.check_in_lng),
+            float(self.class_session.geo_fence_lat), float(self.class_session.geo_fence_lng)
+        )
 
         return round(distance, 2)
 
@@ -1,3 +1,368 @@
-from django.test import TestCase
+import csv
+import json
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import UserProfile, Class, Enrollment, AttendanceRecord, JOIN_PIN_CANDIDATES
+
+
+def make_user(username, role=None, **fields):
+    """Create a user, with a profile when a role is given"""
+    user = User.objects.create_user(username, password='pw', **fields)
+    if role:
+        UserProfile.objects.create(user=user, role=role)
+    return user
+
+
+def make_class(teacher, course_code='CS101', **fields):
+    """Create a class for teacher, deriving the name and join PIN from the course code"""
+    fields.setdefault('join_pin', course_code[-3:].rjust(6, '0'))
+    return Class.objects.create(
+        name=course_code, course_code=course_code, course_name=course_code,
+        teacher=teacher, level='100', section='morning', **fields
+    )
+
+
+class JoinPinTests(TestCase):
+    def test_never_returns_a_pin_in_use(self):
+        teacher = make_user('teacher')
+        make_class(teacher, 'CS101', join_pin='123456')
+        class_obj = make_class(teacher, 'CS201', join_pin='')
+        # The first batch only draws the taken PIN, so a second batch is needed
+        draws = [123456 - 100000] * JOIN_PIN_CANDIDATES + [654321 - 100000] * JOIN_PIN_CANDIDATES
+        with mock.patch('attendance.models.secrets.randbelow', side_effect=draws) as randbelow:
+            class_obj.generate_join_pin()
+        self.assertEqual(randbelow.call_count, 2 * JOIN_PIN_CANDIDATES)
+        class_obj.refresh_from_db()
+        self.assertEqual(class_obj.join_pin, '654321')
+
+
+class TakeAttendanceTests(TestCase):
+    def setUp(self):
+        self.teacher = make_user('teacher', 'teacher')
+        self.student = make_user('student', 'student')
+        self.class_obj = make_class(self.teacher)
+        Enrollment.objects.create(student=self.student, class_enrolled=self.class_obj)
+        self.client.force_login(self.teacher)
+        self.url = reverse('attendance:take_attendance', args=[self.class_obj.id])
+
+    def test_marks_enrolled_students(self):
+        response = self.client.post(self.url, {f'status_{self.student.id}': 'L'})
+        self.assertEqual(response.status_code, 302)
+        record = AttendanceRecord.objects.get(student=self.student, class_session=self.class_obj)
+        self.assertEqual(record.status, 'L')
+
+    def test_second_post_updates_existing_record(self):
+        self.client.post(self.url, {f'status_{self.student.id}': 'P'})
+        stale = timezone.now() - timedelta(hours=1)
+        AttendanceRecord.objects.update(marked_by=None, updated_at=stale)
+        self.client.post(self.url, {f'status_{self.student.id}': 'A'})
+        record = AttendanceRecord.objects.get()
+        self.assertEqual(record.status, 'A')
+        self.assertEqual(record.marked_by, self.teacher)
+        self.assertGreater(record.updated_at, stale)
+
+    def test_ignores_students_not_enrolled(self):
+        outsider = make_user('outsider', 'student')
+        response = self.client.post(self.url, {
+            f'status_{self.student.id}': 'P', f'status_{outsider.id}': 'P',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            list(AttendanceRecord.objects.values_list('student', flat=True)), [self.student.id]
+        )
+
+    def test_ignores_non_ascii_digit_keys(self):
+        response = self.client.post(self.url, {'status_²': 'P', 'status_١': 'P'})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(AttendanceRecord.objects.exists())
+
+
+class CheckInApiTests(TestCase):
+    def setUp(self):
+        self.student = make_user('student', 'student')
+        self.class_obj = make_class(
+            make_user('teacher', 'teacher'),
+            geo_fence_lat='5.60000000', geo_fence_lng='-0.18000000', geo_fence_radius=100
+        )
+        Enrollment.objects.create(student=self.student, class_enrolled=self.class_obj)
+        self.client.force_login(self.student)
+
+    def check_in(self, lat, lng, class_obj=None):
+        return self.client.post(
+            reverse('attendance:api_check_in'),
+            json.dumps({'class_id': (class_obj or self.class_obj).id, 'lat': lat, 'lng': lng}),
+            content_type='application/json'
+        )
+
+    def test_first_check_in_creates_verified_record(self):
+        response = self.check_in(5.6, -0.18)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['created'])
+        record = AttendanceRecord.objects.get()
+        self.assertEqual(record.date, timezone.localdate())
+        self.assertTrue(record.is_valid_location)
+        self.assertEqual(record.verified_distance, 0)
+        self.assertTrue(record.verification_notes.startswith('Valid location'))
+
+    def test_check_in_again_overwrites_verification(self):
+        self.check_in(5.6, -0.18)
+        response = self.check_in(5.602, -0.18)
+        self.assertFalse(response.json()['created'])
+        record = AttendanceRecord.objects.get()
+        self.assertFalse(record.is_valid_location)
+        self.assertGreater(record.verified_distance, 100)
+        self.assertTrue(record.verification_notes.startswith('Outside geo-fence'))
+
+    def test_class_without_geo_fence_clears_stale_distance(self):
+        Class.objects.filter(id=self.class_obj.id).update(geo_fence_lat=None, geo_fence_lng=None)
+        AttendanceRecord.objects.create(
+            student=self.student, class_session=self.class_obj, date=timezone.localdate(),
+            verified_distance='11.12', is_valid_location=True
+        )
+        response = self.check_in(5.6, -0.18)
+        self.assertFalse(response.json()['is_valid_location'])
+        record = AttendanceRecord.objects.get()
+        self.assertIsNone(record.verified_distance)
+        self.assertFalse(record.is_valid_location)
+        self.assertEqual(record.verification_notes, 'Geo-fence not configured for this class')
+
+    def test_student_not_enrolled_is_denied(self):
+        other_class = make_class(self.class_obj.teacher, 'CS201')
+        response = self.check_in(5.6, -0.18, other_class)
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(AttendanceRecord.objects.exists())
+
+
+class JoinClassTests(TestCase):
+    def setUp(self):
+        self.student = make_user('student', 'student')
+        self.class_obj = make_class(make_user('teacher', 'teacher'), join_pin='123456')
+        self.client.force_login(self.student)
+
+    def join(self):
+        response = self.client.post(reverse('attendance:join_class'), {'pin': '123456'}, follow=True)
+        self.assertRedirects(
+            response, reverse('attendance:student_class_detail', args=[self.class_obj.id])
+        )
+        return [str(message) for message in response.context['messages']]
+
+    def test_second_join_warns_without_duplicating(self):
+        self.assertEqual(self.join(), [f'Successfully joined {self.class_obj.course_name}!'])
+        # The rejected insert must not poison the transaction for the rest of the request
+        self.assertEqual(self.join(), ['You are already enrolled in this class.'])
+        self.assertEqual(Enrollment.objects.filter(student=self.student).count(), 1)
+
+
+class VerifyLocationTests(TestCase):
+    def setUp(self):
+        teacher = make_user('teacher')
+        self.class_obj = make_class(
+            teacher, geo_fence_lat='5.60000000', geo_fence_lng='-0.18000000', geo_fence_radius=100
+        )
+        self.client.force_login(teacher)
+        self.url = reverse('attendance:api_verify_location')
+
+    def verify(self):
+        return self.client.get(self.url, {
+            'class_id': self.class_obj.id, 'lat': '5.602', 'lng': '-0.18',
+        }).json()
+
+    def test_reflects_geo_fence_updates(self):
+        self.assertFalse(self.verify()['is_in_range'])
+        Class.objects.filter(id=self.class_obj.id).update(geo_fence_radius=500)
+        self.assertTrue(self.verify()['is_in_range'])
+
+
+@override_settings(GEOLOCATION_SETTINGS={'LOCATION_DATA_RETENTION_DAYS': 30})
+class PurgeLocationDataTests(TestCase):
+    def setUp(self):
+        self.class_obj = make_class(make_user('teacher'))
+        self.today = timezone.localdate()
+
+    def located_record(self, student, days_ago):
+        return AttendanceRecord.objects.create(
+            student=student, class_session=self.class_obj,
+            date=self.today - timedelta(days=days_ago), status='P',
+            check_in_lat='5.60000000', check_in_lng='-0.18000000', check_in_accuracy='10.00',
+            verified_distance='11.12', is_valid_location=True,
+            verification_notes='Valid location: 11.12m from center (within 100m radius)'
+        )
+
+    def purge(self):
+        call_command('purge_location_data', stdout=StringIO())
+
+    def assertCleared(self, record):
+        record.refresh_from_db()
+        self.assertIsNone(record.check_in_lat)
+        self.assertIsNone(record.check_in_lng)
+        self.assertIsNone(record.check_in_accuracy)
+        self.assertIsNone(record.verified_distance)
+        self.assertEqual(record.verification_notes, '')
+        self.assertTrue(record.is_valid_location)
+
+    def assertKept(self, record):
+        record.refresh_from_db()
+        self.assertIsNotNone(record.check_in_lat)
+        self.assertIsNotNone(record.verified_distance)
+
+    def test_uses_each_profile_retention_period(self):
+        short = make_user('short')
+        UserProfile.objects.create(user=short, location_data_retention_days=7)
+        long = make_user('long')
+        UserProfile.objects.create(user=long, location_data_retention_days=60)
+        short_record = self.located_record(short, 10)
+        long_record = self.located_record(long, 10)
+        self.purge()
+        self.assertCleared(short_record)
+        self.assertKept(long_record)
+
+    def test_students_without_profile_use_default(self):
+        student = make_user('student')
+        old_record = self.located_record(student, 31)
+        self.purge()
+        self.assertCleared(old_record)
+
+    def test_keeps_records_on_the_boundary_day(self):
+        student = make_user('student')
+        UserProfile.objects.create(user=student, location_data_retention_days=7)
+        boundary = self.located_record(student, 7)
+        expired = AttendanceRecord.objects.create(
+            student=student, class_session=self.class_obj,
+            date=self.today - timedelta(days=8), check_in_lat='5.60000000', check_in_lng='-0.18000000'
+        )
+        self.purge()
+        self.assertKept(boundary)
+        expired.refresh_from_db()
+        self.assertIsNone(expired.check_in_lat)
+
+    def test_default_boundary_for_students_without_profile(self):
+        student = make_user('student')
+        boundary = self.located_record(student, 30)
+        self.purge()
+        self.assertKept(boundary)
+
+
+class ClassStudentsApiTests(TestCase):
+    def setUp(self):
+        self.teacher = make_user('teacher', 'teacher')
+        self.class_obj = make_class(self.teacher)
+        self.client.force_login(self.teacher)
+        self.url = reverse('attendance:api_class_students', args=[self.class_obj.id])
+
+    def enroll(self, username, **fields):
+        student = make_user(username, **fields)
+        Enrollment.objects.create(student=student, class_enrolled=self.class_obj)
+        return student
+
+    def download(self):
+        response = self.client.get(self.url, {'format': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn('CS101_enrolled_students.csv', response['Content-Disposition'])
+        content = b''.join(response.streaming_content).decode()
+        return list(csv.reader(content.splitlines()))
+
+    def test_streams_roster(self):
+        self.enroll('ama', first_name='Ama', last_name='Mensah', email='ama@example.com')
+        rows = self.download()
+        self.assertEqual(rows[0], ['Username', 'First Name', 'Last Name', 'Email', 'Enrolled At'])
+        self.assertEqual(rows[1][:4], ['ama', 'Ama', 'Mensah', 'ama@example.com'])
+        self.assertEqual(len(rows), 2)
+
+    def test_lists_active_enrollments_only(self):
+        self.enroll('ama')
+        dropped = self.enroll('kofi')
+        Enrollment.objects.filter(student=dropped).update(is_active=False)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([s['username'] for s in response.json()['students']], ['ama'])
+
+    def test_other_teacher_gets_not_found(self):
+        other = make_user('other', 'teacher')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertEqual(self.client.get(self.url, {'format': 'csv'}).status_code, 404)
+
+    def test_student_is_denied(self):
+        student = self.enroll('ama')
+        UserProfile.objects.create(user=student, role='student')
+        self.client.force_login(student)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_filename_is_quoted_and_encoded(self):
+        Class.objects.filter(id=self.class_obj.id).update(course_code='CS"É1')
+        response = self.client.get(self.url, {'format': 'csv'})
+        self.assertEqual(
+            response['Content-Disposition'],
+            "attachment; filename*=utf-8''CS%22%C3%891_enrolled_students.csv"
+        )
+        Class.objects.filter(id=self.class_obj.id).update(course_code='CS"1')
+        response = self.client.get(self.url, {'format': 'csv'})
+        self.assertEqual(
+            response['Content-Disposition'], 'attachment; filename="CS\\"1_enrolled_students.csv"'
+        )
+
+    def test_escapes_formula_cells(self):
+        self.enroll('kofi', first_name='=HYPERLINK("http://x")', last_name='+1', email='@evil')
+        rows = self.download()
+        self.assertEqual(rows[1][1:4], ["'=HYPERLINK(\"http://x\")", "'+1", "'@evil"])
+
+
+class ApiClassesTests(TestCase):
+    def setUp(self):
+        self.teacher = make_user('teacher', 'teacher')
+        other_teacher = make_user('other', 'teacher')
+        self.own = make_class(self.teacher, 'CS101')
+        self.other = make_class(other_teacher, 'CS201')
+        self.inactive = make_class(self.teacher, 'CS301', is_active=False)
+        self.url = reverse('attendance:api_classes')
+
+    def course_codes(self, user):
+        self.client.force_login(user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return [c['course_code'] for c in response.json()['classes']]
+
+    def test_teacher_sees_only_own_active_classes(self):
+        self.assertEqual(self.course_codes(self.teacher), ['CS101'])
+
+    def test_student_sees_only_active_enrollments(self):
+        student = make_user('student', 'student')
+        Enrollment.objects.create(student=student, class_enrolled=self.own)
+        Enrollment.objects.create(student=student, class_enrolled=self.other, is_active=False)
+        Enrollment.objects.create(student=student, class_enrolled=self.inactive)
+        self.assertEqual(self.course_codes(student), ['CS101'])
+
+    def test_admin_sees_all_active_classes(self):
+        admin = make_user('admin', 'admin')
+        self.assertEqual(self.course_codes(admin), ['CS101', 'CS201'])
+
+    def test_user_without_profile_is_denied(self):
+        self.client.force_login(make_user('nobody'))
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 403)
+
+
+class StudentDashboardTests(TestCase):
+    def test_late_counts_as_attended(self):
+        teacher = make_user('teacher')
+        student = make_user('student', 'student')
+        today = timezone.localdate()
+        for i, status in enumerate(['P', 'L', 'A', 'E']):
+            class_obj = make_class(teacher, f'CS10{i}')
+            AttendanceRecord.objects.create(
+                student=student, class_session=class_obj, date=today, status=status
+            )
+        self.client.force_login(student)
+        response = self.client.get(reverse('attendance:student_dashboard'))
+        self.assertEqual(response.context['today_present'], 2)
+        self.assertEqual(response.context['week_attendance'], 50)
+        self.assertEqual(response.context['overall_attendance'], 50)
@@ -2,24 +2,42 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, authenticate, logout
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm
-from django.contrib import messages
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from django.utils import timezone
-from django.db.models import Q, Count
+from django.utils.http import content_disposition_header
+from django.db import IntegrityError, transaction
+from django.db.models import Q, Count, F
 from django.core.paginator import Paginator
+import csv
 import json
-import math
-from datetime import datetime, date, timedelta
+from itertools import chain
+from datetime import datetime, timedelta
 
-from .models import UserProfile, Class, Enrollment, AttendanceRecord
+from .models import UserProfile, Class, Enrollment, AttendanceRecord, geo_distance
 from .forms import (
     CustomUserCreationForm, UserProfileForm, ClassForm, GeoFenceForm,
     AttendanceForm, BulkAttendanceForm, JoinClassForm, LocationCheckInForm
 )
 
+# Maximum rows written per INSERT when attendance is saved in bulk
+ATTENDANCE_BULK_BATCH_SIZE = 1000
+
+# Drop the padding spaces json.dumps adds by default from list responses
+COMPACT_JSON = {'separators': (',', ':')}
+
+# Status codes a teacher may submit when taking attendance
+ATTENDANCE_STATUSES = frozenset(code for code, label in AttendanceRecord.STATUS_CHOICES)
+
+# Statuses that count as attending a session: late arrivals attended, absences and excusals did not
+ATTENDED_STATUSES = ('P', 'L')
+
+# Leading characters that make spreadsheet apps treat a CSV cell as a formula
+CSV_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
 # Utility functions
 def get_user_role(user):
     """Get user role from profile"""
@@ -28,22 +46,22 @@ def get_user_role(user):
     except UserProfile.DoesNotExist:
         return None
 
-def haversine_distance(lat1, lon1, lat2, lon2):
-    """Calculate Haversine distance between two points"""
-    R = 6371000  # Earth's radius in meters
-
-    lat1_rad = math.radians(lat1)
-    lon1_rad = math.radians(lon1)
-    lat2_rad = math.radians(lat2)
-    lon2_rad = math.radians(lon2)
+def attendance_percentage(present, total):
+    """Whole-number percentage of sessions attended"""
+    if not total:
+        return 0
+    return round(present * 100 / total)
 
-    dlat = lat2_rad - lat1_rad
-    dlon = lon2_rad - lon1_rad
+def csv_safe(value):
+    """Escape user-entered text so spreadsheets show it rather than evaluate it"""
+    if value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
 
-    a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-
-    return R * c
+class Echo:
+    """File-like object whose write() hands back the line so csv.writer rows can be streamed"""
+    def write(self, value):
+        return value
 
 # Authentication Views
 def home(request):
@@ -101,15 +119,33 @@ def student_dashboard(request):
     enrollments = Enrollment.objects.filter(
         student=request.user,
         is_active=True
-    ).select_related('class_enrolled')
+    ).select_related('class_enrolled__teacher')
 
+    # The dashboard only lists the five most recent records
     recent_attendance = AttendanceRecord.objects.filter(
         student=request.user
-    ).select_related('class_session').order_by('-date')[:10]
+    ).select_related('class_session').order_by('-date')[:5]
+
+    # All dashboard counters come from one conditional aggregate query;
+    # Present and Late both count as attended (see ATTENDED_STATUSES)
+    today = timezone.localdate()
+    week_start = today - timedelta(days=6)
+    attended = Q(status__in=ATTENDED_STATUSES)
+    stats = AttendanceRecord.objects.filter(student=request.user).aggregate(
+        today_present=Count('id', filter=attended & Q(date=today)),
+        week_total=Count('id', filter=Q(date__gte=week_start)),
+        week_present=Count('id', filter=attended & Q(date__gte=week_start)),
+        total=Count('id'),
+        present=Count('id', filter=attended),
+    )
 
     context = {
         'enrollments': enrollments,
         'recent_attendance': recent_attendance,
+        'today': today,
+        'today_present': stats['today_present'],
+        'week_attendance': attendance_percentage(stats['week_present'], stats['week_total']),
+        'overall_attendance': attendance_percentage(stats['present'], stats['total']),
     }
     return render(request, 'attendance/student_dashboard.html', context)
 
@@ -123,7 +159,7 @@ def student_classes(request):
     enrollments = Enrollment.objects.filter(
         student=request.user,
         is_active=True
-    ).select_related('class_enrolled')
+    ).select_related('class_enrolled__teacher')
 
     context = {
         'enrollments': enrollments,
@@ -137,8 +173,13 @@ def student_class_detail(request, class_id):
         messages.error(request, 'Access denied.')
         return redirect('attendance:dashboard')
 
-    class_obj = get_object_or_404(Class, id=class_id)
-    enrollment = get_object_or_404(Enrollment, student=request.user, class_enrolled=class_obj)
+    # Fetch the enrollment and its class (with teacher) in a single query
+    enrollment = get_object_or_404(
+        Enrollment.objects.select_related('class_enrolled__teacher'),
+        student=request.user,
+        class_enrolled_id=class_id
+    )
+    class_obj = enrollment.class_enrolled
 
     # Get attendance records for this class
     attendance_records = AttendanceRecord.objects.filter(
@@ -180,17 +221,19 @@ def student_check_in(request, class_id):
         messages.error(request, 'Access denied.')
         return redirect('attendance:dashboard')
 
-    class_obj = get_object_or_404(Class, id=class_id)
-
-    # Check if student is enrolled
+    # Check if student is enrolled, loading the class in the same query
     try:
-        enrollment = Enrollment.objects.get(student=request.user, class_enrolled=class_obj, is_active=True)
+        enrollment = Enrollment.objects.select_related('class_enrolled').get(
+            student=request.user,
+            class_enrolled_id=class_id,
+            is_active=True
+        )
     except Enrollment.DoesNotExist:
         messages.error(request, 'You are not enrolled in this class.')
         return redirect('attendance:student_classes')
 
     context = {
-        'class': class_obj,
+        'class': enrollment.class_enrolled,
     }
     return render(request, 'attendance/student_check_in.html', context)
 
@@ -207,11 +250,13 @@ def join_class(request):
             pin = form.cleaned_data['pin']
             try:
                 class_obj = Class.objects.get(join_pin=pin, is_active=True)
-                # Check if already enrolled
-                if Enrollment.objects.filter(student=request.user, class_enrolled=class_obj).exists():
+                # The unique (student, class) constraint reports an existing enrollment
+                try:
+                    with transaction.atomic():
+                        Enrollment.objects.create(student=request.user, class_enrolled=class_obj)
+                except IntegrityError:
                     messages.warning(request, 'You are already enrolled in this class.')
                 else:
-                    Enrollment.objects.create(student=request.user, class_enrolled=class_obj)
                     messages.success(request, f'Successfully joined {class_obj.course_name}!')
                 return redirect('attendance:student_class_detail', class_id=class_obj.id)
             except Class.DoesNotExist:
@@ -272,10 +317,10 @@ def teacher_class_detail(request, class_id):
         is_active=True
     ).select_related('student')
 
-    # Get recent attendance
+    # Get recent attendance, with each record's student joined in
     recent_attendance = AttendanceRecord.objects.filter(
         class_session=class_obj
-    ).order_by('-date')[:10]
+    ).select_related('student').order_by('-date')[:10]
 
     context = {
         'class': class_obj,
@@ -292,27 +337,47 @@ def take_attendance(request, class_id):
         return redirect('attendance:dashboard')
 
     class_obj = get_object_or_404(Class, id=class_id, teacher=request.user)
-    today = date.today()
+    today = timezone.localdate()
 
     if request.method == 'POST':
-        # Process attendance marking
-        attendance_data = {}
-        for key, value in request.POST.items():
-            if key.startswith('status_'):
-                student_id = key.split('_')[1]
-                attendance_data[int(student_id)] = value
-
-        # Create attendance records
-        for student_id, status in attendance_data.items():
-            student = get_object_or_404(User, id=student_id)
-            AttendanceRecord.objects.update_or_create(
-                student=student,
-                class_session=class_obj,
-                date=today,
-                defaults={
-                    'status': status,
-                    'marked_by': request.user,
-                }
+        # Single pass over the form: keep well-formed statuses
+        statuses = {}
+        for key, status in request.POST.items():
+            student_id = key.removeprefix('status_')
+            if student_id == key or status not in ATTENDANCE_STATUSES:
+                continue
+            # isdigit() also accepts characters like '²' that int() rejects
+            if not (student_id.isascii() and student_id.isdecimal()):
+                continue
+            statuses[int(student_id)] = status
+
+        # Nothing to mark: skip the roster lookup and the upsert entirely
+        if statuses:
+            # Look up which posted students are enrolled in one query
+            enrolled_ids = set(Enrollment.objects.filter(
+                class_enrolled=class_obj,
+                is_active=True,
+                student_id__in=statuses,
+            ).values_list('student_id', flat=True))
+
+            # Create or update every record in one multi-row upsert
+            records = [
+                AttendanceRecord(
+                    student_id=student_id,
+                    class_session=class_obj,
+                    date=today,
+                    status=status,
+                    marked_by=request.user,
+                )
+                for student_id, status in statuses.items()
+                if student_id in enrolled_ids
+            ]
+            AttendanceRecord.objects.bulk_create(
+                records,
+                update_conflicts=True,
+                unique_fields=['student', 'class_session', 'date'],
+                update_fields=['status', 'marked_by', 'updated_at'],
+                batch_size=ATTENDANCE_BULK_BATCH_SIZE,
             )
 
         messages.success(request, 'Attendance marked successfully!')
@@ -328,9 +393,10 @@ def take_attendance(request, class_id):
     existing_attendance = AttendanceRecord.objects.filter(
         class_session=class_obj,
         date=today
-    ).select_related('student')
+    )
 
-    existing_dict = {record.student.id: record for record in existing_attendance}
+    # Key on the raw FK column so no User row is joined or hydrated per record
+    existing_dict = {record.student_id: record for record in existing_attendance}
 
     context = {
         'class': class_obj,
@@ -356,36 +422,47 @@ def api_check_in(request):
         if not all([class_id, lat, lng]):
             return JsonResponse({'error': 'Missing required data'}, status=400)
 
-        class_obj = get_object_or_404(Class, id=class_id)
-
-        # Check if student is enrolled
+        # Check if student is enrolled, loading the class in the same query
         try:
-            enrollment = Enrollment.objects.get(
+            enrollment = Enrollment.objects.select_related('class_enrolled').get(
                 student=request.user,
-                class_enrolled=class_obj,
+                class_enrolled_id=class_id,
                 is_active=True
             )
         except Enrollment.DoesNotExist:
             return JsonResponse({'error': 'Not enrolled in this class'}, status=403)
+        class_obj = enrollment.class_enrolled
+
+        # Verify location before writing so the upsert below is the only write
+        check_in = AttendanceRecord(
+            student=request.user,
+            class_session=class_obj,
+            check_in_lat=lat,
+            check_in_lng=lng,
+            check_in_accuracy=accuracy,
+        )
+        is_valid = check_in.verify_location()
+
+        # Read the clock once so the record's date and check-in time agree
+        now = timezone.now()
 
         # Create attendance record with location data
         attendance, created = AttendanceRecord.objects.update_or_create(
             student=request.user,
             class_session=class_obj,
-            date=date.today(),
+            date=timezone.localdate(now),
             defaults={
-                'check_in_time': timezone.now(),
+                'check_in_time': now,
                 'check_in_lat': lat,
                 'check_in_lng': lng,
                 'check_in_accuracy': accuracy,
+                'verified_distance': check_in.verified_distance,
+                'is_valid_location': check_in.is_valid_location,
+                'verification_notes': check_in.verification_notes,
                 'marked_by': request.user,
             }
         )
 
-        # Verify location
-        is_valid = attendance.verify_location()
-        attendance.save()
-
         response_data = {
             'success': True,
             'created': created,
@@ -410,20 +487,24 @@ def api_verify_location(request):
         return JsonResponse({'error': 'Missing parameters'}, status=400)
 
     try:
-        class_obj = get_object_or_404(Class, id=class_id)
+        # Only the geo-fence columns are needed to check the distance
+        geo_fence = get_object_or_404(
+            Class.objects.values('geo_fence_lat', 'geo_fence_lng', 'geo_fence_radius'),
+            id=class_id
+        )
 
         # Calculate distance
-        if class_obj.geo_fence_lat and class_obj.geo_fence_lng:
-            distance = haversine_distance(
+        if geo_fence['geo_fence_lat'] and geo_fence['geo_fence_lng']:
+            distance = geo_distance(
                 float(lat), float(lng),
-                float(class_obj.geo_fence_lat), float(class_obj.geo_fence_lng)
+                float(geo_fence['geo_fence_lat']), float(geo_fence['geo_fence_lng'])
             )
 
-            is_in_range = distance <= class_obj.geo_fence_radius
+            is_in_range = distance <= geo_fence['geo_fence_radius']
 
             return JsonResponse({
                 'distance': round(distance, 2),
-                'radius': class_obj.geo_fence_radius,
+                'radius': geo_fence['geo_fence_radius'],
                 'is_in_range': is_in_range,
             })
         else:
@@ -522,11 +603,74 @@ def bulk_mark_attendance(request):
 
 @login_required
 def api_classes(request):
-    return JsonResponse({'classes': []})
+    """API endpoint listing the classes visible to the current user"""
+    role = get_user_role(request.user)
+    if role == 'teacher':
+        classes = Class.objects.filter(teacher=request.user, is_active=True)
+    elif role == 'student':
+        classes = Class.objects.filter(
+            enrollments__student=request.user,
+            enrollments__is_active=True,
+            is_active=True
+        )
+    elif role == 'admin':
+        classes = Class.objects.filter(is_active=True)
+    else:
+        return JsonResponse({'error': 'Access denied'}, status=403)
+
+    # Fetch plain dicts straight from the cursor instead of building model instances
+    classes = classes.order_by('course_code').values(
+        'id', 'name', 'course_code', 'course_name', 'level', 'section',
+        'geo_fence_lat', 'geo_fence_lng', 'geo_fence_radius'
+    )
+    return JsonResponse({'classes': list(classes)}, json_dumps_params=COMPACT_JSON)
 
 @login_required
 def api_class_students(request, class_id):
-    return JsonResponse({'students': []})
+    """API endpoint listing the students enrolled in a teacher's class"""
+    if get_user_role(request.user) != 'teacher':
+        return JsonResponse({'error': 'Access denied'}, status=403)
+
+    # Ownership check reads only the one column the CSV filename needs
+    course_code = Class.objects.filter(
+        id=class_id,
+        teacher=request.user
+    ).values_list('course_code', flat=True).first()
+    if course_code is None:
+        raise Http404('Class not found')
+
+    # One join over enrollments gives each student together with their enrollment date
+    students = User.objects.filter(
+        enrollments__class_enrolled_id=class_id,
+        enrollments__is_active=True
+    ).order_by('last_name', 'first_name').values(
+        'id', 'username', 'first_name', 'last_name', 'email',
+        enrolled_at=F('enrollments__enrolled_at')
+    )
+
+    if request.GET.get('format') == 'csv':
+        # Stream the roster row by row instead of building the whole file in memory
+        writer = csv.writer(Echo())
+        header = ['Username', 'First Name', 'Last Name', 'Email', 'Enrolled At']
+        rows = (
+            writer.writerow([
+                csv_safe(student['username']), csv_safe(student['first_name']),
+                csv_safe(student['last_name']), csv_safe(student['email']),
+                student['enrolled_at'].isoformat(),
+            ])
+            for student in students.iterator()
+        )
+        response = StreamingHttpResponse(
+            chain([writer.writerow(header)], rows),
+            content_type='text/csv'
+        )
+        # Escapes quotes and RFC 6266-encodes non-ASCII course codes
+        response['Content-Disposition'] = content_disposition_header(
+            True, f'{course_code}_enrolled_students.csv'
+        )
+        return response
+
+    return JsonResponse({'students': list(students)}, json_dumps_params=COMPACT_JSON)
 
 @login_required
 def api_geo_fence(request, class_id):